@@ -0,0 +1,37 @@
+# Copyright 2010-2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# This file is licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Shared boto3 session and clients for the lambdas in this repository.
+A single Session walks the credential provider chain once per cold start, however
+many clients a lambda needs, and every client gets the shared CLIENT_CONFIG.
+Package this module (together with utils.py) with the lambda using it.
+"""
+
+import boto3.session
+
+from utils import CLIENT_CONFIG
+
+_SESSION = boto3.session.Session()
+_CLIENTS = {}
+
+
+def client(service):
+    """
+    Return the shared client for a service, created on first use so each lambda
+    only pays for the clients it actually asks for.
+    :param str service: the boto3 service name, e.g. 's3'
+    :return: the shared boto3 client
+    """
+    if service not in _CLIENTS:
+        _CLIENTS[service] = _SESSION.client(service, config=CLIENT_CONFIG)
+    return _CLIENTS[service]
@@ -48,78 +48,92 @@ For testing you can use the JSON object below, simulating the payload sent by SQ
 
 """
 
-import json
+import secrets
 import time
 
-import boto3
 import os
+from aws_clients import client
+from utils import truthy
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (ship it in a layer); fall back to the stdlib
+    import json as orjson
 
 # Recover & check environment variables
-trace = os.environ.get("TRACE", True)
-if trace in ("true", "True", "TRUE", 1, "Yes", "YES", True):
-    trace = True
-else:
-    trace = False
+trace = truthy(os.environ.get("TRACE", True))
 
 bucket = os.environ.get("BUCKET_NAME")
 if not bucket:
     raise Exception("Environment variable BUCKET_NAME missing")
 
-# Declare teh S3 client
-s3 = boto3.client('s3')
-
-
-def log_me(msg):
-    if trace is True:
-        print(msg)
+# Declare teh S3 client - CLIENT_CONFIG pools enough connections for the concurrent PUTs below
+s3 = client('s3')
+
+# Keep the executor at module scope so warm invocations reuse the threads
+_EXECUTOR = ThreadPoolExecutor(max_workers=10)
+
+
+# Bind log_me once at module load: when tracing is off the call is a cheap no-op
+log_me = print if trace else (lambda *_a, **_k: None)
+
+
+def store_record(record):
+    """Parse one SQS Record and store its payload to S3. Returns the object key."""
+    body_str = record.get('body')
+    # Make sure the records is properly structured and the payload exists
+    if not body_str:
+        raise Exception("No body found in Record")
+    log_me("loading body")
+    body = orjson.loads(body_str)
+    log_me("getting Message")
+    msg = body.get('Message')
+    if not msg:
+        raise Exception("no Payload found")
+    log_me('Getting the payload')
+    # Check that the Message is valid JSON, but store the already-serialized string
+    # as-is: re-dumping the parsed payload would produce the same bytes again
+    payload = orjson.loads(msg)
+    if trace:
+        # Guard the format call so the string is not built when tracing is off
+        log_me("The payload is: {}".format(payload))
+
+    # save to S3 - the random prefix spreads the keys over the S3 index partitions,
+    # a purely time-based name funnels every PUT onto the same (hot) partition
+    key = '{}-{}.json'.format(secrets.token_hex(4), time.time_ns())
+    s3.put_object(
+        Body=msg.encode(),
+        Bucket=bucket,
+        Key=key
+    )
+    if trace:
+        log_me("Object stored: {}".format(key))
+    return key
 
 
 def lambda_handler(event, context):
-    message_ids = []
-
-    if 'Records' in event:
+    if 'Records' in event and trace:
         log_me("Found {} records to store to S3.".format(len(event['Records'])))
-    # First build a list of all the message IDs to process. The list will be depopulated when processed.
-    for record in event.get('Records'):
-        message_ids.append(record['messageId'])
-    log_me("Messages IDs to proceed: {}".format(message_ids))
-    # Process each message in the Records
-    for record in event.get('Records'):
-        # log_me("Record is: {}".format(record))
-        body_str = record.get('body')
-        # log_me("body_str type: {}, value: ...{}...".format(type(body_str), body_str))
+    # All the message IDs to process. The set will be depopulated when processed.
+    pending = {record['messageId'] for record in event.get('Records', ())}
+    if trace:
+        log_me("Messages IDs to proceed: {}".format(pending))
+    # Store all the Records concurrently: each PUT is a network round-trip, not CPU work
+    futures = [(record['messageId'], _EXECUTOR.submit(store_record, record))
+               for record in event.get('Records', ())]
+    for message_id, future in futures:
         try:
-            # Make sure the records is properly structured and the payload exists
-            if not body_str:
-                raise Exception("No body found in Record")
-            log_me("loading body")
-            body = json.loads(body_str)
-            log_me("getting Message")
-            msg = body.get('Message')
-            # log_me("Message type is {} and value is {}".format(type(msg), msg))
-            if not msg:
-                raise Exception("no Payload found")
-            else:
-                log_me('Getting the payload')
-                payload = json.loads(msg)
-                log_me("The payload is: {}".format(payload))
-
-                # save to S3
-                key = '{}.json'.format(time.time_ns())
-                s3.put_object(
-                    Body=json.dumps(payload),
-                    Bucket=bucket,
-                    Key=key
-                )
-
-                log_me("Object stored: {}".format(key))
-                # Finally, remove the item from the list of unprocessed messages
-                log_me("Message ID {} processed successfully".format(record['messageId']))
-                message_ids.remove(record['messageId'])
-
+            future.result()
+            # Finally, remove the item from the set of unprocessed messages
+            if trace:
+                log_me("Message ID {} processed successfully".format(message_id))
+            pending.discard(message_id)
         except Exception as e:
             print("Error when processing a Record: {}".format(e))
 
-    r = {"batchItemFailures": [{"itemIdentifier": x} for x in message_ids]}
-    log_me("Returning unprocessed messages IDs: {}".format(r))
+    r = {"batchItemFailures": [{"itemIdentifier": x} for x in pending]}
+    if trace:
+        log_me("Returning unprocessed messages IDs: {}".format(r))
     return r
@@ -28,8 +28,9 @@ The Role allocated to the Lambda for execution must have the following policies
 
 """
 
-import boto3
 import os
+from aws_clients import client
+from utils import truthy
 
 
 SQS_URL = os.environ.get("SQS_URL")
@@ -38,31 +39,30 @@ if not SQS_URL:
     print(msg)
     raise RuntimeError(msg)
 
-TRACE = os.environ.get("TRACE", True)
-if TRACE in ("true", "True", "TRUE", 1, "Yes", "YES", True):
-    TRACE = True
-else:
-    TRACE = False
+TRACE = truthy(os.environ.get("TRACE", True))
 
 BUCKET = os.environ.get("BUCKET_NAME")
 if not BUCKET:
     raise Exception("Environment variable BUCKET_NAME missing")
 
-s3 = boto3.client('s3')
-sqs = boto3.client('sqs')
+s3 = client('s3')
+sqs = client('sqs')
 
 
-def log_me(msg):
-    if TRACE is True:
-        print(msg)
+# Bind log_me once at module load: when tracing is off the call is a cheap no-op
+log_me = print if TRACE else (lambda *_a, **_k: None)
 
 
-def get_formatted_sqs_attributes(key, bucket=BUCKET):
+# The bucket never changes, so build its attribute once instead of per key
+_BUCKET_ATTR = {
+    'StringValue': str(BUCKET),
+    'DataType': 'String'
+}
+
+
+def get_formatted_sqs_attributes(key):
     return {
-        'bucket': {
-            'StringValue': str(bucket),
-            'DataType': 'String'
-        },
+        'bucket': _BUCKET_ATTR,
         'key': {
             'StringValue': str(key),
             'DataType': 'String'
@@ -70,19 +70,48 @@ def get_formatted_sqs_attributes(key, bucket=BUCKET):
     }
 
 
-def lambda_handler(event, context):
-    response = s3.list_objects(
-        Bucket=str(BUCKET),
+def send_sqs_batch(entries):
+    """
+    Send up to 10 entries with a single SendMessageBatch call and retry once the
+    entries SQS reports as Failed - a dropped entry would mean a dump file that
+    never gets loaded.
+    :param list entries: the batch entries
+    :return: None
+    """
+    response = sqs.send_message_batch(
+        QueueUrl=SQS_URL,
+        Entries=entries
     )
-    for content in response['Contents']:
-        if not content['Key'].endswith('.json'):
-            log_me("Skipping key '{}'".format(content['Key']))
-            continue
-        log_me("Publishing: {}".format(content['Key']))
-        response = sqs.send_message(
-            QueueUrl=SQS_URL,
-            MessageBody='See messageAttributes',
-            DelaySeconds=0,
-            MessageAttributes=get_formatted_sqs_attributes(content['Key'])
-        )
-        log_me(response)
\ No newline at end of file
+    log_me(response)
+    failed = response.get('Failed')
+    if failed:
+        retry_ids = {f['Id'] for f in failed}
+        print("Retrying {} messages rejected by SQS: {}".format(len(retry_ids), sorted(retry_ids)))
+        response = sqs.send_message_batch(QueueUrl=SQS_URL,
+                                          Entries=[e for e in entries if e['Id'] in retry_ids])
+        if response.get('Failed'):
+            raise RuntimeError("SQS rejected messages twice: {}".format(response['Failed']))
+
+
+def lambda_handler(event, context):
+    entries = []
+    # list_objects truncates at 1000 keys, so walk the bucket with the list_objects_v2 paginator
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=str(BUCKET)):
+        for content in page.get('Contents', []):
+            if not content['Key'].endswith(('.json', '.json.zst')):
+                log_me("Skipping key '{}'".format(content['Key']))
+                continue
+            log_me("Publishing: {}".format(content['Key']))
+            entries.append({
+                'Id': str(len(entries)),
+                'MessageBody': 'See messageAttributes',
+                'DelaySeconds': 0,
+                'MessageAttributes': get_formatted_sqs_attributes(content['Key'])
+            })
+            # SQS accepts at most 10 messages per SendMessageBatch call
+            if len(entries) == 10:
+                send_sqs_batch(entries)
+                entries = []
+    if entries:
+        send_sqs_batch(entries)
\ No newline at end of file
@@ -28,22 +28,25 @@ The Role allocated to this Lambda for execution must have the following policies
 """
 
 import json
-import boto3
 import os
 import time
+from aws_clients import client
+from utils import truthy
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (ship it in a layer); fall back to the stdlib
+    import json as orjson
 
 # Declare the required service interfaces
-sns = boto3.client('sns')
-s3 = boto3.client('s3')
+sns = client('sns')
+s3 = client('s3')
 
 # Grab the environment variables set by the User
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 DEAD_BUCKET = os.environ.get('DEAD_LETTER_S3_BUCKET')
-TRACE = os.environ.get("TRACE", False)
-if TRACE in ("true", "True", "TRUE", 1, "Yes", "YES", "yes", True, "T", "Y", "y"):
-    TRACE = True
-else:
-    TRACE = False
+TRACE = truthy(os.environ.get("TRACE", False))
 
 # Grab the environment variables automatically set
 MYSELF = os.environ.get('AWS_LAMBDA_FUNCTION_NAME')
@@ -67,9 +70,8 @@ KEY_CONTRACT = 'contract'  # The key for the contract version in the output payl
 KEYS_EXPECTED = {KEY_TSTAMP, KEY_DATA, KEY_EPOCH, KEY_SITE, KEY_DEVICE, KEY_DATA_MODEL}
 
 
-def log_me(msg):
-    if TRACE is True:
-        print(msg)
+# Bind log_me once at module load: when tracing is off the call is a cheap no-op
+log_me = print if TRACE else (lambda *_a, **_k: None)
 
 
 def validate_payload(payload: dict) -> None:
@@ -115,7 +117,7 @@ def lambda_handler(event, context):
         }
         s3_key = "lambda-{}/{}.json".format(MYSELF, int(time.time() * 1000))
         s3.put_object(
-            Body=json.dumps(msg),
+            Body=orjson.dumps(msg),
             Bucket=DEAD_BUCKET,
             Key=s3_key
         )
@@ -16,6 +16,7 @@ Read the totality of the timestream table and store the metadata and rows in JSO
 Each json document contains at most BLOCKSIZE rows.
 The S3 object keys format is:
     timestream.<DB>.<TB>.<UTC Date & Time>.dump.<page number>.json
+(suffixed .json.zst when the zstandard package is available - objects are then zstd-compressed)
 
 this lambda expects to be called by SQS queue trigger with a payload containing as specific day to process, like this:
 {'filter': '2022-01-01'}
@@ -25,9 +26,14 @@ Configuration:
 Declare the following environment variables:
 :param bool TRACE: True for additional logs
 :param str BUCKET: Destination bucket name
-:param int BLOCKSIZE: The number of pages returned by Timestream packed in a single file. Affects the memory used.
+:param int BLOCKSIZE: The number of pages returned by Timestream packed in a single file. Affects the object sizes.
 :param str DB: Timestream source database name
 :param str TB: Timestream source table name
+:param bool MSGPACK: True when the SQS producer (lambda_write_date_filters_to_SQS.py) packs the
+                     message bodies with msgpack. JSON bodies are still accepted either way.
+:param str DIRECT_INVOKE_ARN: Optional. When set and the zstandard package is absent, dump
+                              documents small enough to fit an async invocation payload are sent
+                              straight to this Lambda (the document is the event) instead of S3.
 
 Tip:
 Increase the execution time of the Lambda function and memory to allow execution on large tables.
@@ -38,21 +44,40 @@ The Role allocated to the Lambda for execution must have the following policies
 * AmazonS3FullAccess
 """
 
-import json
-import boto3
+import base64
+import io
 import os
+import threading
+from aws_clients import client
+from utils import truthy
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime as dt
+from datetime import timedelta
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (ship it in a layer); fall back to the stdlib
+    import json as orjson
+
+try:
+    import zstandard as zstd
+except ImportError:
+    # zstandard is optional (ship it in a layer); without it the dump stays plain JSON
+    zstd = None
+
+try:
+    import msgpack
+except ImportError:
+    # msgpack is optional (ship it in a layer); required only when MSGPACK is enabled
+    msgpack = None
 
 print('Loading function')
 
-s3 = boto3.client('s3')
-tsq = boto3.client('timestream-query')
+s3 = client('s3')
+tsq = client('timestream-query')
 
-TRACE = os.environ.get("TRACE", False)
-if TRACE in ("true", "True", "TRUE", 1, "Yes", "YES", True):
-    TRACE = True
-else:
-    TRACE = False
+TRACE = truthy(os.environ.get("TRACE", False))
 
 BUCKET = os.environ.get("BUCKET")
 if not BUCKET:
@@ -73,6 +98,28 @@ TB = os.environ.get('DBTABLE')
 if not TB:
     raise Exception("Environment variable DBTABLE missing")
 
+MSGPACK = truthy(os.environ.get("MSGPACK", False))
+if MSGPACK and msgpack is None:
+    raise Exception("MSGPACK is enabled but the msgpack package is not packaged with this lambda")
+
+# Optional S3 bypass: small dump documents go straight to the consumer Lambda.
+# Only plain-JSON documents qualify - an invocation payload cannot be zstd bytes -
+# and async (Event) invocations cap the payload at 256 KB.
+DIRECT_INVOKE_ARN = os.environ.get("DIRECT_INVOKE_ARN")
+INVOKE_PAYLOAD_LIMIT = 256 * 1024
+lmb = client('lambda') if DIRECT_INVOKE_ARN else None
+
+# Rows are streamed to S3 through a multipart upload so only one buffered part sits in memory,
+# not a whole BLOCKSIZE worth of pages. S3 requires every part but the last to be at least 5 MiB.
+PART_SIZE = 8 * 1024 * 1024
+
+# Parts upload on this pool so the PUTs overlap fetching the next Timestream pages.
+# The semaphore bounds the parts in flight (and queued): without it, slow PUTs let
+# part bodies pile up in the executor queue, undoing the one-part memory bound.
+_PART_WORKERS = 10
+_EXECUTOR = ThreadPoolExecutor(max_workers=_PART_WORKERS)
+_PART_SLOTS = threading.Semaphore(_PART_WORKERS)
+
 
 def print_query_result(query_result):
     print("--- new page ---")
@@ -83,28 +130,157 @@ def print_query_result(query_result):
         print("Row: {}".format(row))
 
 
-def save_to_s3(pfx, file_nb, payload):
-    print('Storing S3 object #{}'.format(file_nb))
-    OBJ_NAME = pfx + '.{:0>8}.json'.format(file_nb)
-    s3.put_object(
-        Body=json.dumps(payload),
+def parse_body(body_str):
+    """
+    Parse one SQS message body. With MSGPACK enabled the bodies from
+    lambda_write_date_filters_to_SQS.py are base64-wrapped msgpack; bodies that
+    look like JSON are still parsed as such so other producers keep working.
+    :param str body_str: the raw Records.body string
+    :return: the decoded payload dictionary
+    """
+    if MSGPACK and not body_str.lstrip().startswith('{'):
+        return msgpack.unpackb(base64.b64decode(body_str))
+    return orjson.loads(body_str)
+
+
+def json_bytes(payload):
+    """Serialize to JSON bytes (orjson returns bytes, the stdlib fallback returns str)."""
+    body = orjson.dumps(payload)
+    return body if isinstance(body, bytes) else body.encode()
+
+
+def start_s3_object(pfx, file_nb):
+    print('Starting S3 object #{}'.format(file_nb))
+    if zstd is not None:
+        # Dumps are highly repetitive (column names recur in every row) and compress well
+        OBJ_NAME = f'{pfx}.{file_nb:0>8}.json.zst'
+        compressor = zstd.ZstdCompressor(level=3).compressobj()
+    else:
+        OBJ_NAME = f'{pfx}.{file_nb:0>8}.json'
+        compressor = None
+    # The multipart upload is created lazily on the first part flush: objects that
+    # never outgrow one part are written with a single put_object call instead of
+    # the three multipart calls (see finish_s3_object)
+    return {'Key': OBJ_NAME, 'UploadId': None, 'Parts': [], 'NextPart': 1,
+            'Buffer': io.BytesIO(), 'Compressor': compressor}
+
+
+def write_to_upload(upload, data):
+    """Append bytes to the upload buffer, through the compressor when one is attached."""
+    compressor = upload['Compressor']
+    if compressor is not None:
+        data = compressor.compress(data)
+    if data:
+        upload['Buffer'].write(data)
+
+
+def flush_part(upload):
+    # Hand the buffered part to the executor; completion is collected in finish_s3_object
+    if upload['UploadId'] is None:
+        if upload['Compressor'] is not None:
+            mpu = s3.create_multipart_upload(Bucket=BUCKET, Key=upload['Key'], ContentEncoding='zstd')
+        else:
+            mpu = s3.create_multipart_upload(Bucket=BUCKET, Key=upload['Key'])
+        upload['UploadId'] = mpu['UploadId']
+    part_nb = upload['NextPart']
+    upload['NextPart'] += 1
+    body = upload['Buffer'].getvalue()
+    # Blocks while _PART_WORKERS parts are already in flight (same pattern as the
+    # loader's submit_write)
+    _PART_SLOTS.acquire()
+
+    def upload_and_release():
+        try:
+            return s3.upload_part(
+                Bucket=BUCKET,
+                Key=upload['Key'],
+                PartNumber=part_nb,
+                UploadId=upload['UploadId'],
+                Body=body
+            )
+        finally:
+            _PART_SLOTS.release()
+
+    upload['Parts'].append((part_nb, _EXECUTOR.submit(upload_and_release)))
+    upload['Buffer'] = io.BytesIO()
+
+
+def abort_s3_object(upload):
+    """
+    Abort an in-progress multipart upload so a failed dump does not leave
+    orphaned parts behind - S3 bills them until an abort (or a lifecycle rule,
+    which this deployment does not configure) removes them.
+    :param dict upload: the upload state returned by start_s3_object
+    :return: None
+    """
+    if upload['UploadId'] is None:
+        # Nothing was created on the S3 side yet
+        return
+    # Let the queued parts settle first: a part landing after the abort would be re-orphaned
+    for _, future in upload['Parts']:
+        try:
+            future.result()
+        except Exception:
+            pass
+    try:
+        s3.abort_multipart_upload(Bucket=BUCKET, Key=upload['Key'], UploadId=upload['UploadId'])
+        print("Aborted multipart upload of '{}'".format(upload['Key']))
+    except Exception as e:
+        # Do not mask the original failure - just report the leftover upload
+        print("Could not abort multipart upload of '{}': {}".format(upload['Key'], e))
+
+
+def finish_s3_object(upload):
+    # Close the JSON framing, then drain whatever the compressor still holds
+    write_to_upload(upload, b']}')
+    if upload['Compressor'] is not None:
+        upload['Buffer'].write(upload['Compressor'].flush())
+    if upload['UploadId'] is None:
+        if (lmb is not None and upload['Compressor'] is None
+                and upload['Buffer'].tell() < INVOKE_PAYLOAD_LIMIT):
+            # Bypass S3 entirely: hand the document to the consumer as its event
+            print('Invoking {} directly with object {}'.format(DIRECT_INVOKE_ARN, upload['Key']))
+            lmb.invoke(FunctionName=DIRECT_INVOKE_ARN, InvocationType='Event',
+                       Payload=upload['Buffer'].getvalue())
+            return
+        # The object never crossed PART_SIZE: one put_object beats the three
+        # multipart calls for the short date-window dumps
+        if upload['Compressor'] is not None:
+            s3.put_object(Bucket=BUCKET, Key=upload['Key'], Body=upload['Buffer'].getvalue(),
+                          ContentEncoding='zstd')
+        else:
+            s3.put_object(Bucket=BUCKET, Key=upload['Key'], Body=upload['Buffer'].getvalue())
+        return
+    if upload['Buffer'].tell():
+        flush_part(upload)
+    # Wait for the queued parts and surface their errors before completing
+    parts = [{'ETag': future.result()['ETag'], 'PartNumber': part_nb}
+             for part_nb, future in upload['Parts']]
+    s3.complete_multipart_upload(
         Bucket=BUCKET,
-        Key=OBJ_NAME
+        Key=upload['Key'],
+        UploadId=upload['UploadId'],
+        MultipartUpload={'Parts': parts}
     )
 
 
 def lambda_handler(event, context):
     for record in event.get('Records', [{}]):
-        body = json.loads(record.get('body', '{}'))
+        body = parse_body(record.get('body', '{}'))
         filter = body.get('filter')
         if not filter:
             msg = "event not correctly formatted. Read the docstring. \n Event is: {}".format(event)
             print(msg)
             raise RuntimeError(msg)
         OBJ_PFX = 'timestream.{}.{}.{}.{}.dump'.format(DB, TB, filter, dt.utcnow().strftime("%Y-%m-%dT%H-%M-%S"))
+        # Filter on a half-open time range: unlike date_trunc('day', time) = <filter>,
+        # a plain range predicate lets Timestream prune the scanned partitions.
+        # Parsing the filter also validates it before it is embedded in the query.
+        day = dt.strptime(filter, '%Y-%m-%d')
+        lo = day.strftime('%Y-%m-%d 00:00:00')
+        hi = (day + timedelta(days=1)).strftime('%Y-%m-%d 00:00:00')
         QRY = 'SELECT * FROM "{}"."{}"'.format(DB, TB)
-        if filter:
-            QRY += " WHERE date_trunc('day', time) = '{}'".format(filter)
+        QRY += " WHERE time >= '{}' AND time < '{}'".format(lo, hi)
         QRY += " ORDER BY time ASC"
         print('Querying Timestream with: {}'.format(QRY))
         paginator = tsq.get_paginator('query')
@@ -112,27 +288,45 @@ def lambda_handler(event, context):
         pg_nb = 0
         pg_count = 0
         file_nb = 0
-        rows = []
-        for page in page_iterator:
-            pg_nb += 1
-            pg_count += 1
-            if TRACE is True:
-                print_query_result(page)
-            if pg_count == 1:
-                # Store the columns info
-                columns = page.get("ColumnInfo")
-            rows.extend(page.get("Rows"))
-
-            if pg_count >= BLOCKSIZE:
-                print("Reached {} pages, rolling to new S3 Object".format(BLOCKSIZE))
-                pg_count = 0
-                file_nb += 1
-                save_to_s3(OBJ_PFX, file_nb, {"Rows": rows, "ColumnInfo": columns})
-                rows = []
-
-        if rows:
-            file_nb += 1
-            save_to_s3(OBJ_PFX, file_nb, {"Rows": rows, "ColumnInfo": columns})
+        upload = None
+        wrote_rows = False
+        try:
+            for page in page_iterator:
+                pg_nb += 1
+                pg_count += 1
+                if TRACE is True:
+                    print_query_result(page)
+                if upload is None:
+                    # Open the next S3 object and write the columns info and the Rows framing
+                    file_nb += 1
+                    upload = start_s3_object(OBJ_PFX, file_nb)
+                    write_to_upload(upload, b'{"ColumnInfo":' + json_bytes(page.get("ColumnInfo")) + b',"Rows":[')
+                    wrote_rows = False
+                # Append the page rows to the object, stripping the enclosing brackets
+                chunk = json_bytes(page.get("Rows"))[1:-1]
+                if chunk:
+                    if wrote_rows:
+                        write_to_upload(upload, b',')
+                    write_to_upload(upload, chunk)
+                    wrote_rows = True
+                if upload['Buffer'].tell() >= PART_SIZE:
+                    flush_part(upload)
+
+                if pg_count >= BLOCKSIZE:
+                    print("Reached {} pages, rolling to new S3 Object".format(BLOCKSIZE))
+                    pg_count = 0
+                    finish_s3_object(upload)
+                    upload = None
+
+            if upload is not None:
+                finish_s3_object(upload)
+                upload = None
+        except Exception:
+            # A failed part upload, pagination error or completion error must not
+            # leave the multipart upload open
+            if upload is not None:
+                abort_s3_object(upload)
+            raise
         print('Dump finished without interruption: {} pages processed and {} files written'.format(pg_nb, file_nb))
 
     return {}
@@ -25,6 +25,10 @@ This lambda expects to be called by SQS queue trigger with the following element
 
 The body can stay empty.
 
+Alternatively the dumper can invoke this lambda directly (see DIRECT_INVOKE_ARN in
+lambda_timestream_dump_to_s3_json.py): the event is then the dump document itself and
+S3 is bypassed entirely.
+
 Configuration:
 Declare the following environment variables:
 :param bool TRACE: True for additional logs
@@ -47,21 +51,31 @@ The Role allocated to the Lambda for execution must have the following policies
 * AWSLambdaSQSQueueExecutionRole
 """
 
-import boto3
+import calendar
 import os
-import json
-from dateutil import parser
+import threading
+from aws_clients import client
+from utils import truthy
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (ship it in a layer); fall back to the stdlib
+    import json as orjson
+
+try:
+    import zstandard as zstd
+except ImportError:
+    # zstandard is optional (ship it in a layer); required to read .json.zst dumps
+    zstd = None
 
 print("Loading function")
 
-s3 = boto3.client('s3')
-tsw = boto3.client('timestream-write')
+s3 = client('s3')
+tsw = client('timestream-write')
 
-TRACE = os.environ.get("TRACE", False)
-if TRACE in ("true", "True", "TRUE", 1, "Yes", "YES", True):
-    TRACE = True
-else:
-    TRACE = False
+TRACE = truthy(os.environ.get("TRACE", False))
 
 DB = os.environ.get("DBNAME")
 if not DB:
@@ -74,10 +88,20 @@ if not TB:
 # Constants
 MAX_RECORDS = 100  # Timestream service quota
 
+# The destination table cannot change while the execution environment lives, so the
+# DescribeTable round-trip is only paid once per cold start
+_TABLE_CHECKED = False
+
+# Overlap the WriteRecords round-trips. The semaphore bounds the batches in flight
+# (and queued) so a large object does not pile up record batches in memory, and
+# keeps the pressure on the per-table write quota reasonable.
+_WRITE_WORKERS = 8
+_EXECUTOR = ThreadPoolExecutor(max_workers=_WRITE_WORKERS)
+_WRITE_SLOTS = threading.Semaphore(_WRITE_WORKERS)
+
 
-def log_me(msg):
-    if TRACE is True:
-        print(msg)
+# Bind log_me once at module load: when tracing is off the call is a cheap no-op
+log_me = print if TRACE else (lambda *_a, **_k: None)
 
 
 def check_table_exists(db, tb):
@@ -91,34 +115,64 @@ def check_table_exists(db, tb):
 def get_s3_object(bucket, key):
     try:
         response = s3.get_object(Bucket=bucket, Key=key)
-        obj = json.loads(response['Body'].read())
+        raw = response['Body'].read()
+        if key.endswith('.zst'):
+            if zstd is None:
+                raise RuntimeError("Object '{}' is zstd-compressed but the zstandard "
+                                   "package is not packaged with this lambda".format(key))
+            raw = zstd.ZstdDecompressor().decompressobj().decompress(raw)
+        obj = orjson.loads(raw)
         return obj
     except Exception as e:
         msg = "Error when fetching the S3 object: {}".format(e)
         raise RuntimeError(msg)
 
 
-def get_record_template():
-    return {
-        'Dimensions': [],
-        'MeasureName': '',
-        'MeasureValue': '',
-        'MeasureValueType': '',
-        'Time': '',
-        'TimeUnit': 'MILLISECONDS'
-    }
-
-
-def get_dim_template():
-    return {
-        'Name': '',
-        'Value': '',
-        'DimensionValueType': ''
-    }
+def get_column_schema(column_info):
+    """
+    Resolve once per object what each column is (name, scalar type and role)
+    so the per-row loop does not repeat the dict lookups for every cell.
+    Dimension columns also carry a prototype dict with the constant Name and
+    DimensionValueType, so each row only has to add its Value.
+    :param column_info: the ColumnInfo list of the dump object
+    :return: list of (name, type, role, dimension prototype) tuples, one per column
+    """
+    cols = []
+    for ci in column_info:
+        name = ci["Name"]
+        tpe = ci["Type"]["ScalarType"]
+        proto = None
+        if name == 'time':
+            role = 'TIME'
+        elif name.startswith("measure_value"):
+            role = 'MEASURE_VALUE'
+        elif name == 'measure_name':
+            role = 'MEASURE_NAME'
+        else:
+            role = 'DIMENSION'
+            proto = {'Name': name, 'DimensionValueType': tpe}
+        cols.append((name, tpe, role, proto))
+    return cols
 
 
 def get_timestamp(date):
-    return int(1000 * parser.parse(date + 'Z').timestamp())
+    """
+    Convert a dump timestamp (UTC, '%Y-%m-%d %H:%M:%S.nanoseconds') to epoch milliseconds.
+    The format is fixed (see the module docstring) so the fields are sliced at known
+    offsets instead of running a generic parser - this is called once per row.
+    :param str date: the timestamp string from the dump
+    :return: epoch in milliseconds
+    """
+    try:
+        seconds = calendar.timegm((int(date[0:4]), int(date[5:7]), int(date[8:10]),
+                                   int(date[11:13]), int(date[14:16]), int(date[17:19])))
+        millis = int(date[20:23]) if len(date) > 20 else 0
+        return seconds * 1000 + millis
+    except ValueError:
+        # Unexpected format: fall back to the generic parser. Imported lazily so the
+        # cold start does not pay for dateutil when every timestamp is well-formed.
+        from dateutil import parser
+        return int(1000 * parser.parse(date + 'Z').timestamp())
 
 
 def write_to_timestream(records):
@@ -127,7 +181,8 @@ def write_to_timestream(records):
                                      TableName=TB,
                                      Records=records)
 
-        log_me("Response from Timestream write: {}".format(response))
+        if TRACE:
+            log_me("Response from Timestream write: {}".format(response))
 
     except tsw.exceptions.RejectedRecordsException as e:
         print("Timestream returned a RejectedRecordsException")
@@ -138,9 +193,100 @@ def write_to_timestream(records):
         raise RuntimeError(msg)
 
 
+def submit_write(records):
+    """
+    Queue one batch of records for writing on the executor.
+    Blocks while _WRITE_WORKERS batches are already in flight.
+    :param records: the batch to write
+    :return: the Future of the queued write
+    """
+    _WRITE_SLOTS.acquire()
+
+    def write_and_release():
+        try:
+            write_to_timestream(records)
+        finally:
+            _WRITE_SLOTS.release()
+
+    return _EXECUTOR.submit(write_and_release)
+
+
+def ingest_document(obj):
+    """
+    Write every row of one dump document to Timestream.
+    :param dict obj: the dump document ({"ColumnInfo": [...], "Rows": [...]})
+    :return: None
+    """
+    records = []
+    futures = []
+    print('Found {} rows to ingest'.format(len(obj["Rows"])))
+    cols = get_column_schema(obj["ColumnInfo"])
+    rows_count = 0
+    for row in obj["Rows"]:
+        record = {
+            'Dimensions': [],
+            'MeasureName': '',
+            'MeasureValue': '',
+            'MeasureValueType': '',
+            'Time': '',
+            'TimeUnit': 'MILLISECONDS'
+        }
+        for idx, data in enumerate(row["Data"]):
+            k, v = next(iter(data.items()))
+            name, tpe, role, proto = cols[idx]
+            if k != "ScalarValue":
+                # NullValues cannot be written to Timestream. Log other types when detected
+                if k != 'NullValue':
+                    print("Ignoring unsupported Type: {}".format(k))
+                if TRACE:
+                    # Guard the format call: it would run for every skipped cell even with tracing off
+                    log_me("Skipping row: index {}, data {}".format(idx, data))
+                continue
+            if role == 'TIME':
+                # This is a timestamp
+                record["Time"] = str(get_timestamp(v))
+            elif role == 'MEASURE_VALUE':
+                # This is a measured value
+                record["MeasureValue"] = v
+                record["MeasureValueType"] = tpe
+            elif role == 'MEASURE_NAME':
+                # This is the name of the measurement
+                record["MeasureName"] = v
+            else:
+                # Everything else is a Dimension - expand the per-column prototype
+                record["Dimensions"].append({**proto, 'Value': v})
+        # add the record to the records
+        records.append(record)
+        rows_count += 1
+        if len(records) == MAX_RECORDS:
+            # Queue the batch for writing and reset
+            if TRACE:
+                log_me("Maximum number of {} records reached. Writing to Timestream.".format(MAX_RECORDS))
+            futures.append(submit_write(records))
+            print("Records queued so far: {}".format(rows_count))
+            records = []
+    if records:
+        # Write to Timestream the last piece
+        print("Writing the remaining {} records to Timestream".format(len(records)))
+        futures.append(submit_write(records))
+    # Wait for the queued writes and surface their errors
+    for future in futures:
+        future.result()
+    print("Total number of records written: {}".format(rows_count))
+
+
 def lambda_handler(event, context):
+    global _TABLE_CHECKED
     log_me("starting")
-    check_table_exists(DB, TB)
+    if not _TABLE_CHECKED:
+        check_table_exists(DB, TB)
+        _TABLE_CHECKED = True
+    if 'ColumnInfo' in event and 'Rows' in event:
+        # Direct invocation from the dumper: the event is the dump document itself.
+        # Errors propagate so the async invocation gets retried instead of lost.
+        print("Direct-invoke dump document received")
+        ingest_document(event)
+        return
     for record in event.get('Records', [{}]):
         try:
             bucket = record['messageAttributes']['bucket']['stringValue']
@@ -151,52 +297,6 @@ def lambda_handler(event, context):
             log_me("Fetching object '{}/{}'".format(bucket, key))
             obj = get_s3_object(bucket, key)
             print("Document '{}/{}' successfully read".format(bucket, key))
-            records = []
-            print('Found {} rows to ingest'.format(len(obj["Rows"])))
-            rows_count = 0
-            for row in obj["Rows"]:
-                record = get_record_template()
-                for idx, data in enumerate(row["Data"]):
-                    k, v = list(data.items())[0]
-                    name = obj["ColumnInfo"][idx]["Name"]
-                    tpe = obj["ColumnInfo"][idx]["Type"]["ScalarType"]
-                    if k != "ScalarValue":
-                        # NullValues cannot be written to Timestream. Log other types when detected
-                        if k != 'NullValue':
-                            print("Ignoring unsupported Type: {}".format(k))
-                        log_me("Skipping row: index {}, data {}".format(idx, data))
-                        continue
-                    if name == 'time':
-                        # This is a timestamp
-                        record["Time"] = str(get_timestamp(v))
-                    elif name.startswith("measure_value"):
-                        # This is a measured value
-                        record["MeasureValue"] = v
-                        record["MeasureValueType"] = tpe
-                    elif name == 'measure_name':
-                        # This is the name of the measurement
-                        record["MeasureName"] = v
-                    else:
-                        # Everything else is a Dimension
-                        dim = get_dim_template()
-                        dim["Name"] = name
-                        dim["Value"] = v
-                        dim["DimensionValueType"] = tpe
-                        # Add the dimension to the record
-                        record["Dimensions"].append(dim)
-                # add the record to the records
-                records.append(record)
-                rows_count += 1
-                if len(records) == MAX_RECORDS:
-                    # Write to Timestream and reset
-                    log_me("Maximum number of {} records reached. Writing to Timestream.".format(MAX_RECORDS))
-                    write_to_timestream(records)
-                    print("Records written so far: {}".format(rows_count))
-                    records = []
-            if records:
-                # Write to Timestream the last piece
-                print("Writing the remaining {} records to Timestream".format(len(records)))
-                write_to_timestream(records)
-            print("Total number of records written: {}".format(rows_count))
+            ingest_document(obj)
         except Exception as e:
             log_me(e)
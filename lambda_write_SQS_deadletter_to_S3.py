@@ -11,10 +11,16 @@
 # specific language governing permissions and limitations under the License.
 
 
-import json
-import boto3
 import os
+import secrets
 import time
+from aws_clients import client
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (ship it in a layer); fall back to the stdlib
+    import json as orjson
 
 # Recover & check environment variables
 bucket = os.environ.get("DEADLETTER_BUCKET_NAME")
@@ -22,15 +28,16 @@ bucket = os.environ.get("DEADLETTER_BUCKET_NAME")
 if not bucket:
     raise Exception("Environment variable BUCKET_NAME missing")
 
-s3 = boto3.client('s3')
+s3 = client('s3')
 
 
 # noinspection PyUnusedLocal
 def lambda_handler(event, context):
-    # save to S3 without further processing
-    key = str(time.time_ns())
+    # save to S3 without further processing - the random prefix spreads the keys
+    # over the S3 index partitions instead of hammering a single time-ordered one
+    key = '{}-{}'.format(secrets.token_hex(4), time.time_ns())
     s3.put_object(
-        Body=json.dumps(event),
+        Body=orjson.dumps(event),
         Bucket=bucket,
         Key=key
     )
@@ -20,6 +20,8 @@ Configuration:
 Create a SQS queues with batch = 1
 Declare the following environment variables:
 :param bool TRACE: True for additional logs
+:param bool MSGPACK: True to pack the message bodies with msgpack (base64-wrapped) instead of JSON.
+                     Enable it on the consumer (lambda_timestream_dump_to_s3_json.py) as well.
 
 The Role allocated to the Lambda for execution must have the following policies (or less permissive equivalent):
 * AWSLambdaBasicExecutionRole
@@ -27,10 +29,19 @@ The Role allocated to the Lambda for execution must have the following policies
 
 """
 
+import base64
 import json
-import boto3
 import os
 import datetime as dt
+from aws_clients import client
+from utils import truthy
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:
+    # msgpack is optional (ship it in a layer); required only when MSGPACK is enabled
+    msgpack = None
 
 START_DAY = os.environ.get("START_DAY")
 if not START_DAY:
@@ -44,40 +55,98 @@ if not START_DAY:
     print(msg)
     raise RuntimeError(msg)
 
+# Parse the day range once at cold start - a malformed date fails the deploy, not every run
+try:
+    START = dt.datetime.strptime(START_DAY, "%Y-%m-%d")
+    END = dt.datetime.strptime(END_DAY, "%Y-%m-%d")
+except ValueError as e:
+    msg = "START_DAY/END_DAY must be formatted '%Y-%m-%d': {}".format(e)
+    print(msg)
+    raise RuntimeError(msg)
+
 SQS_URL = os.environ.get("SQS_URL")
 if not SQS_URL:
     msg = "Missing environment variable 'SQS_URL"
     print(msg)
     raise RuntimeError(msg)
 
-TRACE = os.environ.get("TRACE", True)
-if TRACE in ("true", "True", "TRUE", 1, "Yes", "YES", True):
-    TRACE = True
-else:
-    TRACE = False
+# FIFO queues need a MessageGroupId, and the date makes a natural deduplication
+# id so re-running the same range does not enqueue the days twice
+FIFO = SQS_URL.endswith('.fifo')
+
+TRACE = truthy(os.environ.get("TRACE", True))
+
+MSGPACK = truthy(os.environ.get("MSGPACK", False))
+if MSGPACK and msgpack is None:
+    raise Exception("MSGPACK is enabled but the msgpack package is not packaged with this lambda")
+
+sqs = client('sqs')
+
+# Keep the executor at module scope so warm invocations reuse the threads
+_EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+
+# Bind log_me once at module load: when tracing is off the call is a cheap no-op
+log_me = print if TRACE else (lambda *_a, **_k: None)
+
 
-sqs = boto3.client('sqs')
+def send_sqs_batch(entries):
+    """
+    Send up to 10 entries with a single SendMessageBatch call and retry once the
+    entries SQS reports as Failed.
+    :param list entries: the batch entries
+    :return: None
+    """
+    response = sqs.send_message_batch(QueueUrl=SQS_URL, Entries=entries)
+    log_me(response)
+    failed = response.get('Failed')
+    if failed:
+        retry_ids = {f['Id'] for f in failed}
+        print("Retrying {} messages rejected by SQS: {}".format(len(retry_ids), sorted(retry_ids)))
+        response = sqs.send_message_batch(QueueUrl=SQS_URL,
+                                          Entries=[e for e in entries if e['Id'] in retry_ids])
+        if response.get('Failed'):
+            raise RuntimeError("SQS rejected messages twice: {}".format(response['Failed']))
 
 
-def log_me(msg):
-    if TRACE is True:
-        print(msg)
+def format_body(d):
+    """
+    Serialize a message body: msgpack wrapped in base64 (SQS bodies must be text)
+    when MSGPACK is enabled, plain JSON otherwise.
+    :param dict d: the message payload
+    :return: the MessageBody string
+    """
+    if MSGPACK:
+        return base64.b64encode(msgpack.packb(d)).decode()
+    return json.dumps(d)
 
 
 def lambda_handler(event, context):
     try:
-        current = dt.datetime.strptime(START_DAY, "%Y-%m-%d")
-        end = dt.datetime.strptime(END_DAY, "%Y-%m-%d")
         log_me("Using SQS URL: '{}'".format(SQS_URL))
-        while current <= end:
-            d = {'filter': current.strftime("%Y-%m-%d")}
-            response = sqs.send_message(
-                QueueUrl=SQS_URL,
-                MessageBody=json.dumps(d),
-                DelaySeconds=0
-            )
-            log_me(response)
-            current += dt.timedelta(days=1)
+        # Build all the date strings first, then slice them into SendMessageBatch groups:
+        # separating the compute from the I/O lets the batches go out concurrently
+        dates = [(START + dt.timedelta(days=i)).strftime("%Y-%m-%d")
+                 for i in range((END - START).days + 1)]
+        if FIFO:
+            # FIFO entries cannot carry per-message DelaySeconds
+            entries = [{
+                'Id': str(i % 10),
+                'MessageBody': format_body({'filter': date}),
+                'MessageGroupId': 'date-filter',
+                'MessageDeduplicationId': date
+            } for i, date in enumerate(dates)]
+        else:
+            entries = [{
+                'Id': str(i % 10),
+                'MessageBody': format_body({'filter': date}),
+                'DelaySeconds': 0
+            } for i, date in enumerate(dates)]
+        # SQS accepts at most 10 messages per SendMessageBatch call
+        batches = [entries[i:i + 10] for i in range(0, len(entries), 10)]
+        # Send the batches concurrently - the calls are network-latency-bound.
+        # list() drains the iterator so every batch completes (or raises) here.
+        list(_EXECUTOR.map(send_sqs_batch, batches))
     except Exception as e:
         print("Exception during runtime: {}".format(e))
         raise
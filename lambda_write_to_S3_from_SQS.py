@@ -11,9 +11,10 @@
 # specific language governing permissions and limitations under the License.
 
 """
-This lambda reads a payload received from SQS. It expects to find a JSON payload in the Message.
+This lambda reads a payload received from SQS. It expects a JSON payload either in the Message key
+(SNS fan-out) or directly in the Record body (plain SQS).
 The payload content is checked for specific keys.
-Metrics on Lambda execution are sent to CloudWatch.
+Metrics on Lambda execution are published through the CloudWatch Embedded Metric Format log lines.
 
 Configuration:
 Declare the following environment variables:
@@ -25,127 +26,140 @@ The Role allocated to the Lambda for execution must have the following policies
 * AWSLambdaBasicExecutionRole
 * AWSLambdaSQSQueueExecutionRole
 * AmazonS3FullAccess
-* [TODO]: Figure out policy for sending CloudWatch metrics
 """
 
-import json
-import boto3
+import logging
 import os
+import time
 import datetime as dt
+from aws_clients import client
+from utils import truthy
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional (ship it in a layer); fall back to the stdlib
+    import json as orjson
 
 # Recover & check environment variables
 bucket = os.environ.get("BUCKET_NAME")
-trace = os.environ.get("TRACE", True)
-if trace in ("true", "True", "TRUE", 1, "Yes", "YES", True):
-    trace = True
-else:
-    trace = False
-
-inspect = os.environ.get("INSPECT", False)
-if inspect in ("true", "True", "TRUE", 1, "Yes", "YES", True):
-    inspect = True
-else:
-    inspect = False
+trace = truthy(os.environ.get("TRACE", True))
+
+inspect = truthy(os.environ.get("INSPECT", False))
 
 if not bucket:
     raise Exception("Environment variable BUCKET_NAME missing")
 
-s3 = boto3.client('s3')
-cw = boto3.client('cloudwatch')
-
-TIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
-
-
-def log_me(msg):
-    if trace is True:
-        print(msg)
-
-
-def send_cw_metric(name, dims, unit, value, namespace):
-    response = cw.put_metric_data(
-        MetricData=[
-            {
-                'MetricName': name,
-                'Dimensions': dims,
-                'Unit': unit,
-                'Value': value,
-                'Timestamp': dt.datetime.utcnow()
-            },
-        ],
-        Namespace=namespace
+s3 = client('s3')
+
+# Keep the executor at module scope so warm invocations reuse the threads
+_EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+# One lock-protected log call per message instead of several print() statements:
+# cheaper CloudWatch ingest and no stdout contention between the worker threads.
+# Trace details go to DEBUG, where %s formatting is deferred until a handler wants it.
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG if trace else logging.INFO)
+
+
+def emit_batch_size_metric(batch_size):
+    """
+    Publish the batch size through the CloudWatch Embedded Metric Format: a structured
+    log line CloudWatch turns into a metric, with no API round-trip per invocation.
+    :param int batch_size: number of Records in the event
+    :return: None
+    """
+    emf = orjson.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": "Custom Lambda Metrics",
+                "Dimensions": [["Function"]],
+                "Metrics": [{"Name": "Batch Size", "Unit": "Count"}]
+            }]
+        },
+        "Function": "SQS_to_S3",
+        "Batch Size": batch_size
+    })
+    print(emf.decode() if isinstance(emf, bytes) else emf)
+
+
+def process_record(record):
+    """Parse, inspect and store one SQS Record to S3. Returns the object key."""
+    body_str = record.get('body')
+    # Make sure the records is properly structured and the payload exists
+    if not body_str:
+        raise Exception("No body found in Record")
+    body = orjson.loads(body_str)
+    # SNS fan-out wraps the payload in a Message string; when SQS is wired directly
+    # the body is already the payload and the second decode is skipped
+    msg = body.get('Message')
+    if msg is None:
+        payload = body
+    elif isinstance(msg, str):
+        payload = orjson.loads(msg)
+    else:
+        payload = msg
+    logger.debug("The payload is: %s", payload)
+    if inspect is True:
+        timestring = payload.get('timestamp')
+        if not timestring:
+            raise Exception('Malformed payload: timestamp key missing')
+        thing = payload.get('gateway')
+        if not thing:
+            raise Exception('Malformed payload: thing key missing')
+        device = payload.get('deviceName')
+        if not device:
+            raise Exception('Malformed payload: thing key missing')
+        epoch = payload.get('epoch_ms')
+        if not epoch:
+            raise Exception('Malformed payload: thing key missing')
+        value = payload.get('values')
+        logger.debug("values in payload: %s", value)
+        if not value:
+            raise Exception("Empty payload found")
+        # Check that the timestamp is in the right format and genera the S3 object key.
+        # fromisoformat handles the offset and skips strptime's per-call format parsing.
+        tstamp = dt.datetime.fromisoformat(timestring)
+    else:
+        # Do not inspect payload - try to retrieve timestamp in ms or generate it
+        epoch = payload.get('epoch_ms', int(dt.datetime.utcnow().timestamp()*1000))
+        thing = payload.get('gateway', payload.get('device_name', 'unknown_gateway'))
+        device = payload.get('deviceName',  payload.get('site_name', 'unknown_device'))
+        tstamp = dt.datetime.fromtimestamp(epoch/1000, dt.timezone.utc)
+
+    # save to S3 - an f-string: this runs for every record and skips .format's spec parsing
+    key = f"{tstamp.year:02d}/{tstamp.month:02d}/{tstamp.day:02d}/{thing}/{device}/{epoch}.json"
+    s3.put_object(
+        Body=orjson.dumps(payload),
+        Bucket=bucket,
+        Key=key
     )
-    log_me(response)
+    return key
 
 
 # noinspection PyUnusedLocal
 def lambda_handler(event, context):
-    message_ids = []
-
     if 'Records' in event:
-        print("Found {} records to store to S3.".format(len(event['Records'])))
-        dims = [{'Name': 'Function', 'Value': 'SQS_to_S3'}]
-        send_cw_metric(name='Batch Size', dims=dims, unit='Count', value=len(event['Records']),
-                       namespace='Custom Lambda Metrics')
-    # First build a list of all the message IDs to process. The list will be depopulated when processed.
-    for record in event.get('Records'):
-        message_ids.append(record['messageId'])
-    log_me("Messages IDs to proceed: {}".format(message_ids))
-    # Process each message in the Records
-    for record in event.get('Records'):
-        body_str = record.get('body')
+        logger.info("Found %d records to store to S3.", len(event['Records']))
+        emit_batch_size_metric(len(event['Records']))
+    # Start with every message ID unprocessed; successes are discarded in O(1)
+    unprocessed = {record['messageId'] for record in event.get('Records')}
+    logger.debug("Messages IDs to proceed: %s", unprocessed)
+    # Process the Records concurrently: each record is one small PUT, all latency
+    futures = [(record['messageId'], _EXECUTOR.submit(process_record, record))
+               for record in event.get('Records')]
+    for message_id, future in futures:
         try:
-            # Make sure the records is properly structured and the payload exists
-            if not body_str:
-                raise Exception("No body found in Record")
-            body = json.loads(body_str)
-            msg = body.get('Message')
-            if not msg:
-                raise Exception("no Payload found")
-            else:
-                payload = json.loads(msg)
-                log_me("The payload is: {}".format(payload))
-                if inspect is True:
-                    timestring = payload.get('timestamp')
-                    if not timestring:
-                        raise Exception('Malformed payload: timestamp key missing')
-                    thing = payload.get('gateway')
-                    if not thing:
-                        raise Exception('Malformed payload: thing key missing')
-                    device = payload.get('deviceName')
-                    if not device:
-                        raise Exception('Malformed payload: thing key missing')
-                    epoch = payload.get('epoch_ms')
-                    if not epoch:
-                        raise Exception('Malformed payload: thing key missing')
-                    value = payload.get('values')
-                    log_me("values in payload: {}".format(value))
-                    if not value:
-                        raise Exception("Empty payload found")
-                    # Check that the timestamp is in the right format and genera the S3 object key
-                    tstamp = dt.datetime.strptime(timestring, TIME_FORMAT)
-                else:
-                    # Do not inspect payload - try to retrieve timestamp in ms or generate it
-                    epoch = payload.get('epoch_ms', int(dt.datetime.utcnow().timestamp()*1000))
-                    thing = payload.get('gateway', payload.get('device_name', 'unknown_gateway'))
-                    device = payload.get('deviceName',  payload.get('site_name', 'unknown_device'))
-                    tstamp = dt.datetime.fromtimestamp(epoch/1000, dt.timezone.utc)
-
-                # save to S3
-                key = "{:02d}/{:02d}/{:02d}/{}/{}/{}.json".format(tstamp.year, tstamp.month, tstamp.day,
-                                                                  thing, device, epoch)
-                s3.put_object(
-                    Body=json.dumps(payload),
-                    Bucket=bucket,
-                    Key=key
-                )
-                log_me("Object stored: {}".format(key))
-                # Finally remove the item from the list of unprocessed messages
-                log_me("Message ID {} processed successfully".format(record['messageId']))
-                message_ids.remove(record['messageId'])
-
+            key = future.result()
+            # The one summary line per record
+            logger.info("record stored: messageId=%s key=%s", message_id, key)
+            unprocessed.discard(message_id)
         except Exception as e:
-            print("Error when processing a Record: {}".format(e))
+            logger.error("Error when processing a Record: %s", e)
 
-    r = {"batchItemFailures": [{"itemIdentifier": x} for x in message_ids]}
-    log_me("Returning unprocessed messages IDs: {}".format(r))
+    r = {"batchItemFailures": [{"itemIdentifier": x} for x in unprocessed]}
+    logger.debug("Returning unprocessed messages IDs: %s", r)
     return r
@@ -13,13 +13,25 @@
 
 import json
 import urllib.parse
-import boto3
 import os
+from aws_clients import client
 
 print('Loading function')
 
-s3 = boto3.client('s3')
-ts = boto3.client('timestream-write')
+s3 = client('s3')
+ts = client('timestream-write')
+
+# Read the environment once at cold start - a missing variable fails the deploy, not every run
+DB = os.environ.get("DB_NAME")
+if not DB:
+    raise Exception("Environment variable DB_NAME missing")
+
+TABLE = os.environ.get("TABLE_NAME")
+if not TABLE:
+    raise Exception("Environment variable TABLE_NAME missing")
+
+# Constants
+MAX_RECORDS = 100  # Timestream service quota per WriteRecords call
 
 
 def format_for_timestream(data):
@@ -46,15 +58,12 @@ def format_for_timestream(data):
             'Time': str(data['epoch_ms']),
             'TimeUnit': 'MILLISECONDS'
         }
-        vals = data['values']
-        records = []
-        for k,v in vals.items():
-            r = {
-                'MeasureName': k,
-                'MeasureValue': str(v),
-                'MeasureValueType': 'BIGINT' if isinstance(v, int) else 'DOUBLE'
-            }
-            records.append(r.copy())
+        # Each iteration builds a fresh dict, so no defensive copy is needed
+        records = [{
+            'MeasureName': k,
+            'MeasureValue': str(v),
+            'MeasureValueType': 'BIGINT' if isinstance(v, int) else 'DOUBLE'
+        } for k, v in data['values'].items()]
         return common_attr, records
     except Exception as e:
         print("Error when preparing data for timestream: {}".format(e))
@@ -71,32 +80,26 @@ def write_to_timestream(db, table, common_attributes, records):
     :param list records: records to be written
     :return: None
     """
-    try:
-        result = ts.write_records(DatabaseName=db,
-                                  TableName=table,
-                                  Records=records,
-                                  CommonAttributes=common_attributes)
-
-        print("WriteRecords Status: [%s]" % result['ResponseMetadata']['HTTPStatusCode'])
-    except ts.exceptions.RejectedRecordsException as err:
-        print("RejectedRecords: ", err)
-        for rr in err.response["RejectedRecords"]:
-            print("Rejected Index " + str(rr["RecordIndex"]) + ": " + rr["Reason"])
-        print("Other records were written successfully. ")
-    except Exception as e:
-        raise e
+    # Timestream accepts at most MAX_RECORDS records per call, so slice the payload
+    for i in range(0, len(records), MAX_RECORDS):
+        try:
+            result = ts.write_records(DatabaseName=db,
+                                      TableName=table,
+                                      Records=records[i:i + MAX_RECORDS],
+                                      CommonAttributes=common_attributes)
+
+            print("WriteRecords Status: [%s]" % result['ResponseMetadata']['HTTPStatusCode'])
+        except ts.exceptions.RejectedRecordsException as err:
+            print("RejectedRecords: ", err)
+            for rr in err.response["RejectedRecords"]:
+                print("Rejected Index " + str(i + rr["RecordIndex"]) + ": " + rr["Reason"])
+            print("Other records were written successfully. ")
+        except Exception as e:
+            raise e
 
 
 def lambda_handler(event, context):
-    # Get Environment variables
     print("Starting work")
-    try:
-        db = os.environ.get("DB_NAME")
-        table = os.environ.get("TABLE_NAME")
-    except KeyError as e:
-        print("Error getting the environment variables: {}".format(e))
-        raise e
-
     try:
         # Get the object from the event and fetch its content
         bucket = event['Records'][0]['s3']['bucket']['name']
@@ -115,7 +118,7 @@ def lambda_handler(event, context):
     try:
         # Format the data for Timestream and write it
         cattr, recs = format_for_timestream(data)
-        write_to_timestream(db=db, table=table, common_attributes=cattr, records=recs)
+        write_to_timestream(db=DB, table=TABLE, common_attributes=cattr, records=recs)
         print("Finished without error")
     except Exception as e:
         print("Error when pushing data to Timestream")
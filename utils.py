@@ -0,0 +1,39 @@
+# Copyright 2010-2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+# This file is licensed under the Apache License, Version 2.0 (the "License").
+# You may not use this file except in compliance with the License. A copy of
+# the License is located at
+#
+# http://aws.amazon.com/apache2.0/
+#
+# This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR
+# CONDITIONS OF ANY KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations under the License.
+
+"""
+Small helpers shared by the lambdas in this repository.
+Package this module together with the lambda using it.
+"""
+
+from botocore.config import Config
+
+# One client configuration for all the lambdas: TCP keepalive avoids re-running the
+# TLS handshake on warm invocations, adaptive retries back off on throttling, and
+# the connection pool is sized for the handlers that fan their calls out on threads.
+CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    tcp_keepalive=True,
+    retries={'mode': 'adaptive', 'max_attempts': 5}
+)
+
+# The affirmative spellings accepted for boolean environment variables
+_TRUTHY_VALUES = frozenset(('true', 'yes', '1', 't', 'y'))
+
+
+def truthy(value):
+    """
+    Interpret an environment variable value as a boolean.
+    :param value: the raw value (string, bool, int or None)
+    :return: True when the value reads as affirmative
+    """
+    return str(value).strip().lower() in _TRUTHY_VALUES